@@ -16,30 +16,51 @@ This module provides the functions to create and configure a new tokenizer
 as well as instantiating the appropriate tokenizer for updating an existing
 database.
 """
-from typing import Optional
+from typing import Dict, Optional
+import functools
 import logging
 import importlib
+import sys
 from pathlib import Path
 
 from ..errors import UsageError
-from ..db import properties
-from ..db.connection import connect
 from ..config import Configuration
 from ..tokenizer.base import AbstractTokenizer, TokenizerModule
 
 LOG = logging.getLogger()
 
+# Caches the name of the tokenizer used per database, so that repeated
+# lookups in the same process do not need a database round-trip.
+_TOKENIZER_NAME_CACHE: Dict[str, str] = {}
 
+
+def invalidate_tokenizer_name_cache(dsn: Optional[str] = None) -> None:
+    """ Remove the cached tokenizer name for the given DSN or for all
+        databases, when no DSN is given. Only needed when a database is
+        newly set up in the same process.
+    """
+    if dsn is None:
+        _TOKENIZER_NAME_CACHE.clear()
+    else:
+        _TOKENIZER_NAME_CACHE.pop(dsn, None)
+
+
+@functools.lru_cache(maxsize=4)
 def _import_tokenizer(name: str) -> TokenizerModule:
     """ Load the tokenizer.py module from project directory.
+
+        The lookup result is cached, so repeated calls for the same
+        tokenizer are free.
     """
-    src_file = Path(__file__).parent / (name + '_tokenizer.py')
-    if not src_file.is_file():
-        LOG.fatal("No tokenizer named '%s' available. "
-                  "Check the setting of NOMINATIM_TOKENIZER.", name)
-        raise UsageError('Tokenizer not found')
+    module_name = 'nominatim_db.tokenizer.' + name + '_tokenizer'
+    if module_name not in sys.modules:
+        src_file = Path(__file__).parent / (name + '_tokenizer.py')
+        if not src_file.is_file():
+            LOG.fatal("No tokenizer named '%s' available. "
+                      "Check the setting of NOMINATIM_TOKENIZER.", name)
+            raise UsageError('Tokenizer not found')
 
-    return importlib.import_module('nominatim_db.tokenizer.' + name + '_tokenizer')
+    return importlib.import_module(module_name)
 
 
 def create_tokenizer(config: Configuration, init_db: bool = True,
@@ -49,6 +70,9 @@ def create_tokenizer(config: Configuration, init_db: bool = True,
         The tokenizer data and code is copied into the 'tokenizer' directory
         of the project directory and the tokenizer loaded from its new location.
     """
+    from ..db import properties
+    from ..db.connection import connect
+
     if module_name is None:
         module_name = config.TOKENIZER
 
@@ -60,6 +84,7 @@ def create_tokenizer(config: Configuration, init_db: bool = True,
 
     with connect(config.get_libpq_dsn()) as conn:
         properties.set_property(conn, 'tokenizer', module_name)
+    invalidate_tokenizer_name_cache(config.get_libpq_dsn())
 
     return tokenizer
 
@@ -70,12 +95,20 @@ def get_tokenizer_for_db(config: Configuration) -> AbstractTokenizer:
         The function looks up the appropriate tokenizer in the database
         and initialises it.
     """
-    with connect(config.get_libpq_dsn()) as conn:
-        name = properties.get_property(conn, 'tokenizer')
+    from ..db import properties
+    from ..db.connection import connect
 
+    dsn = config.get_libpq_dsn()
+    name = _TOKENIZER_NAME_CACHE.get(dsn)
     if name is None:
-        LOG.fatal("Tokenizer was not set up properly. Database property missing.")
-        raise UsageError('Cannot initialize tokenizer.')
+        with connect(dsn) as conn:
+            name = properties.get_property(conn, 'tokenizer')
+
+        if name is None:
+            LOG.fatal("Tokenizer was not set up properly. Database property missing.")
+            raise UsageError('Cannot initialize tokenizer.')
+
+        _TOKENIZER_NAME_CACHE[dsn] = name
 
     tokenizer_module = _import_tokenizer(name)
 
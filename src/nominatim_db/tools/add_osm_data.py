@@ -13,7 +13,7 @@ import logging
 import urllib
 
 from ..db.connection import connect
-from ..utils.url_utils import get_url
+from ..utils.url_utils import open_url
 from .exec_utils import run_osm2pgsql
 
 LOG = logging.getLogger()
@@ -62,8 +62,10 @@ def add_osm_object(dsn: str, osm_type: str, osm_id: int, use_main_api: bool,
                    + urllib.parse.urlencode({'data': data})
 
     options['append'] = True
-    options['import_data'] = get_url(base_url).encode('utf-8')
-
-    _run_osm2pgsql(dsn, options)
+    # Stream the response directly into osm2pgsql instead of buffering
+    # the complete object data in memory first.
+    with open_url(base_url) as response:
+        options['import_data'] = response
+        _run_osm2pgsql(dsn, options)
 
     return 0
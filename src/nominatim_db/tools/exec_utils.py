@@ -69,9 +69,28 @@ def run_osm2pgsql(options: Mapping[str, Any]) -> None:
     else:
         cmd.append(str(options['import_file']))
 
-    subprocess.run(cmd, cwd=options.get('cwd', '.'),
-                   input=options.get('import_data'),
-                   env=env, check=True)
+    import_data = options.get('import_data')
+    if import_data is not None and hasattr(import_data, 'read'):
+        # File-like input is streamed to osm2pgsql in chunks, so that the
+        # full data never needs to be held in memory.
+        with subprocess.Popen(cmd, cwd=options.get('cwd', '.'),
+                              stdin=subprocess.PIPE, env=env) as proc:
+            assert proc.stdin is not None
+            # When osm2pgsql exits early, writing fails with a broken pipe.
+            # Ignore it here, the returncode check below reports the failure.
+            try:
+                shutil.copyfileobj(import_data, proc.stdin, length=1024 * 1024)
+            except BrokenPipeError:
+                pass
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    else:
+        subprocess.run(cmd, cwd=options.get('cwd', '.'),
+                       input=import_data, env=env, check=True)
 
 
 def _mk_tablespace_options(ttype: str, options: Mapping[str, Any]) -> List[str]:
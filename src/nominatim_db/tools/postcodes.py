@@ -8,20 +8,19 @@
 Functions for importing, updating and otherwise maintaining the table
 of artificial postcode centroids.
 """
-from typing import Optional, Tuple, Dict, List, TextIO
+from typing import Any, ContextManager, Optional, Tuple, Dict, List, TextIO, TYPE_CHECKING
 from collections import defaultdict
+from contextlib import nullcontext
 from pathlib import Path
-import csv
-import gzip
 import logging
+import os
+import re
 from math import isfinite
 
-from psycopg import sql as pysql
-
-from ..db.connection import connect, Connection, table_exists
-from ..utils.centroid import PointsCentroid
-from ..data.postcode_format import PostcodeFormatter, CountryPostcodeMatcher
-from ..tokenizer.base import AbstractAnalyzer, AbstractTokenizer
+if TYPE_CHECKING:
+    from ..db.connection import Connection
+    from ..data.postcode_format import CountryPostcodeMatcher
+    from ..tokenizer.base import AbstractAnalyzer, AbstractTokenizer
 
 LOG = logging.getLogger()
 
@@ -42,67 +41,92 @@ class _PostcodeCollector:
     """ Collector for postcodes of a single country.
     """
 
-    def __init__(self, country: str, matcher: Optional[CountryPostcodeMatcher]):
+    def __init__(self, country: str, matcher: Optional['CountryPostcodeMatcher']):
         self.country = country
         self.matcher = matcher
-        self.collected: Dict[str, PointsCentroid] = defaultdict(PointsCentroid)
-        self.normalization_cache: Optional[Tuple[str, Optional[str]]] = None
+        # Maps a postcode to [sum of x, sum of y, number of points].
+        self.collected: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0, 0])
 
-    def add(self, postcode: str, x: float, y: float) -> None:
-        """ Add the given postcode to the collection cache. If the postcode
-            already existed, it is overwritten with the new centroid.
+    def add(self, postcode: str, x: float, y: float, count: int = 1) -> None:
+        """ Add the given postcode to the collection cache. (x, y) is the
+            centroid of 'count' points with this postcode. Postcodes that
+            normalize to the same form are merged into a weighted centroid.
         """
         if self.matcher is not None:
-            normalized: Optional[str]
-            if self.normalization_cache and self.normalization_cache[0] == postcode:
-                normalized = self.normalization_cache[1]
-            else:
-                match = self.matcher.match(postcode)
-                normalized = self.matcher.normalize(match) if match else None
-                self.normalization_cache = (postcode, normalized)
-
+            match = self.matcher.match(postcode)
+            normalized = self.matcher.normalize(match) if match else None
             if normalized:
-                self.collected[normalized] += (x, y)
+                entry = self.collected[normalized]
+                entry[0] += x * count
+                entry[1] += y * count
+                entry[2] += count
 
-    def commit(self, conn: Connection, analyzer: AbstractAnalyzer,
-               project_dir: Optional[Path]) -> None:
+    def commit(self, conn: 'Connection', analyzer: 'AbstractAnalyzer',
+               external_file: Optional[Path]) -> None:
         """ Update postcodes for the country from the postcodes selected so far.
 
-            When 'project_dir' is set, then any postcode files found in this
-            directory are taken into account as well.
+            When 'external_file' is set, then the postcodes from this file
+            are taken into account as well.
         """
-        if project_dir is not None:
-            self._update_from_external(analyzer, project_dir)
+        from psycopg import Pipeline
+
+        if external_file is not None:
+            self._update_from_external(analyzer, external_file)
         to_add, to_delete, to_update = self._compute_changes(conn)
 
         LOG.info("Processing country '%s' (%s added, %s deleted, %s updated).",
                  self.country, len(to_add), len(to_delete), len(to_update))
 
         with conn.cursor() as cur:
+            # First load the staging tables. COPY is not available in
+            # pipeline mode and has to go out separately.
             if to_add:
-                cur.executemany(pysql.SQL(
-                    """INSERT INTO location_postcode
-                         (place_id, indexed_status, country_code,
-                          postcode, geometry)
-                       VALUES (nextval('seq_place'), 1, {}, %s,
-                               ST_SetSRID(ST_MakePoint(%s, %s), 4326))
-                    """).format(pysql.Literal(self.country)),
-                    to_add)
-            if to_delete:
-                cur.execute("""DELETE FROM location_postcode
-                               WHERE country_code = %s and postcode = any(%s)
-                            """, (self.country, to_delete))
+                cur.execute("""CREATE TEMP TABLE tmp_postcode_add
+                                   (postcode TEXT, x FLOAT8, y FLOAT8)""")
+                with cur.copy('COPY tmp_postcode_add (postcode, x, y) FROM STDIN') as copy:
+                    for add_row in to_add:
+                        copy.write_row(add_row)
             if to_update:
-                cur.executemany(
-                    pysql.SQL("""UPDATE location_postcode
-                                 SET indexed_status = 2,
-                                     geometry = ST_SetSRID(ST_Point(%s, %s), 4326)
-                                 WHERE country_code = {} and postcode = %s
-                              """).format(pysql.Literal(self.country)),
-                    to_update)
+                cur.execute("""CREATE TEMP TABLE tmp_postcode_update
+                                   (postcode TEXT, x FLOAT8, y FLOAT8)""")
+                with cur.copy('COPY tmp_postcode_update (x, y, postcode) FROM STDIN') as copy:
+                    for update_row in to_update:
+                        copy.write_row(update_row)
+
+            # Then send the remaining statements in a single batch.
+            # Pipeline mode needs libpq 14+; with older versions the
+            # statements simply go out one by one.
+            if Pipeline.is_supported():
+                batch: ContextManager[Any] = conn.pipeline()
+            else:
+                batch = nullcontext()
+            with batch:
+                if to_add:
+                    cur.execute("""INSERT INTO location_postcode
+                                     (place_id, indexed_status, country_code,
+                                      postcode, geometry)
+                                   SELECT nextval('seq_place'), 1, %s, postcode,
+                                          ST_SetSRID(ST_MakePoint(x, y), 4326)
+                                   FROM tmp_postcode_add
+                                """, (self.country, ))
+                    cur.execute('DROP TABLE tmp_postcode_add')
+                if to_delete:
+                    cur.execute("""DELETE FROM location_postcode
+                                   WHERE country_code = %s and postcode = any(%s)
+                                """, (self.country, to_delete))
+                if to_update:
+                    cur.execute("""UPDATE location_postcode
+                                   SET indexed_status = 2,
+                                       geometry = ST_SetSRID(
+                                                    ST_MakePoint(tmp.x, tmp.y), 4326)
+                                   FROM tmp_postcode_update tmp
+                                   WHERE country_code = %s
+                                         and location_postcode.postcode = tmp.postcode
+                                """, (self.country, ))
+                    cur.execute('DROP TABLE tmp_postcode_update')
 
     def _compute_changes(
-            self, conn: Connection
+            self, conn: 'Connection'
             ) -> Tuple[List[Tuple[str, float, float]], List[str], List[Tuple[float, float, str]]]:
         """ Compute which postcodes from the collected postcodes have to be
             added or modified and which from the location_postcode table
@@ -110,90 +134,140 @@ class _PostcodeCollector:
         """
         to_update = []
         to_delete = []
-        with conn.cursor() as cur:
+        # Use a server-side cursor, so that the existing postcodes are
+        # streamed in batches instead of being materialized all at once.
+        with conn.cursor(name=f'postcodes_{self.country}') as cur:
+            cur.itersize = 10000
             cur.execute("""SELECT postcode, ST_X(geometry), ST_Y(geometry)
                            FROM location_postcode
                            WHERE country_code = %s""",
                         (self.country, ))
             for postcode, x, y in cur:
                 pcobj = self.collected.pop(postcode, None)
-                if pcobj:
-                    newx, newy = pcobj.centroid()
-                    if (x - newx) > 0.0000001 or (y - newy) > 0.0000001:
+                if pcobj is not None:
+                    newx = pcobj[0] / pcobj[2]
+                    newy = pcobj[1] / pcobj[2]
+                    dx = x - newx
+                    dy = y - newy
+                    # Update when the point has moved in any direction by
+                    # more than about 1e-7 degrees.
+                    if dx * dx + dy * dy > 1e-14:
                         to_update.append((newx, newy, postcode))
                 else:
                     to_delete.append(postcode)
 
-        to_add = [(k, *v.centroid()) for k, v in self.collected.items()]
-        self.collected = defaultdict(PointsCentroid)
+        to_add = [(k, v[0] / v[2], v[1] / v[2]) for k, v in self.collected.items()]
+        self.collected.clear()
 
         return to_add, to_delete, to_update
 
-    def _update_from_external(self, analyzer: AbstractAnalyzer, project_dir: Path) -> None:
-        """ Look for an external postcode file for the active country in
-            the project directory and add missing postcodes when found.
+    def _update_from_external(self, analyzer: 'AbstractAnalyzer', fname: Path) -> None:
+        """ Add missing postcodes from the given external postcode file.
         """
-        csvfile = self._open_external(project_dir)
-        if csvfile is None:
-            return
+        import csv
+
+        csvfile = self._open_external(fname)
 
         try:
-            reader = csv.DictReader(csvfile)
+            reader = csv.reader(csvfile)
+            header = next(reader, None)
+            if header is None \
+               or any(name not in header for name in ('postcode', 'lat', 'lon')):
+                LOG.warning("Bad format for external postcode file for country '%s'."
+                            " Ignored.", self.country)
+                return
+            pc_idx = header.index('postcode')
+            lat_idx = header.index('lat')
+            lon_idx = header.index('lon')
+
             for row in reader:
-                if 'postcode' not in row or 'lat' not in row or 'lon' not in row:
-                    LOG.warning("Bad format for external postcode file for country '%s'."
-                                " Ignored.", self.country)
-                    return
-                postcode = analyzer.normalize_postcode(row['postcode'])
+                if not row:
+                    continue
+                postcode = analyzer.normalize_postcode(row[pc_idx])
                 if postcode not in self.collected:
                     try:
                         # Do float conversation separately, it might throw
-                        centroid = (_to_float(row['lon'], 180),
-                                    _to_float(row['lat'], 90))
-                        self.collected[postcode] += centroid
+                        self.collected[postcode] = [_to_float(row[lon_idx], 180),
+                                                    _to_float(row[lat_idx], 90), 1]
                     except ValueError:
                         LOG.warning("Bad coordinates %s, %s in %s country postcode file.",
-                                    row['lat'], row['lon'], self.country)
+                                    row[lat_idx], row[lon_idx], self.country)
 
         finally:
             csvfile.close()
 
-    def _open_external(self, project_dir: Path) -> Optional[TextIO]:
-        fname = project_dir / f'{self.country}_postcodes.csv'
+    def _open_external(self, fname: Path) -> TextIO:
+        import gzip
+
+        LOG.info("Using external postcode file '%s'.", fname)
+        if fname.suffix == '.gz':
+            return gzip.open(fname, 'rt')
 
-        if fname.is_file():
-            LOG.info("Using external postcode file '%s'.", fname)
-            return open(fname, 'r', encoding='utf-8')
+        return open(fname, 'r', encoding='utf-8')
 
-        fname = project_dir / f'{self.country}_postcodes.csv.gz'
 
-        if fname.is_file():
-            LOG.info("Using external postcode file '%s'.", fname)
-            return gzip.open(fname, 'rt')
+def _scan_external_postcode_files(project_dir: Optional[Path]) -> Dict[str, Path]:
+    """ Find the external postcode files in the project directory and
+        return a map of country code to file path. When both a plain and
+        a gzipped file exist for a country, the plain one wins.
+    """
+    files: Dict[str, Path] = {}
+    if project_dir is not None and project_dir.is_dir():
+        for entry in os.scandir(project_dir):
+            match = re.match(r'([a-z]{2})_postcodes\.csv(\.gz)?$', entry.name)
+            if match and entry.is_file():
+                if match.group(2) is None or match.group(1) not in files:
+                    files[match.group(1)] = Path(entry.path)
 
-        return None
+    return files
 
 
-def update_postcodes(dsn: str, project_dir: Optional[Path], tokenizer: AbstractTokenizer) -> None:
+def update_postcodes(dsn: str, project_dir: Optional[Path],
+                     tokenizer: 'AbstractTokenizer') -> None:
     """ Update the table of artificial postcodes.
 
         Computes artificial postcode centroids from the placex table,
         potentially enhances it with external data and then updates the
         postcodes in the table 'location_postcode'.
     """
+    from ..db.connection import connect
+    from ..data.postcode_format import PostcodeFormatter
+
+    from concurrent.futures import Future, ThreadPoolExecutor
+
     matcher = PostcodeFormatter()
+    external_files = _scan_external_postcode_files(project_dir)
     with tokenizer.name_analyzer() as analyzer:
-        with connect(dsn) as conn:
+        # Use a separate connection for writing back the changes, so that
+        # a country can be committed while the next one is aggregated.
+        with connect(dsn) as conn, connect(dsn) as write_conn:
             # First get the list of countries that currently have postcodes.
             # (Doing this before starting to insert, so it is fast on import.)
             with conn.cursor() as cur:
                 cur.execute("SELECT DISTINCT country_code FROM location_postcode")
                 todo_countries = set((row[0] for row in cur))
 
-            # Recompute the list of valid postcodes from placex.
-            with conn.cursor(name="placex_postcodes") as cur:
+            # The writes for a finished country are handed to a single
+            # worker thread, hiding the commit latency behind the
+            # aggregation of the next country. The worker is the only
+            # user of the write connection.
+            pending: Optional['Future[None]'] = None
+
+            def _commit_country(executor: ThreadPoolExecutor,
+                                collector: _PostcodeCollector) -> None:
+                nonlocal pending
+                if pending is not None:
+                    pending.result()
+                pending = executor.submit(collector.commit, write_conn, analyzer,
+                                          external_files.get(collector.country))
+
+            # Recompute the list of valid postcodes from placex. Aggregation
+            # over the raw postcodes already happens in the database, so that
+            # Python only sees one row per (country, postcode) pair.
+            with ThreadPoolExecutor(max_workers=1) as executor, \
+                 conn.cursor(name="placex_postcodes") as cur:
                 cur.execute("""
-                SELECT cc, pc, ST_X(centroid), ST_Y(centroid)
+                SELECT cc, pc, AVG(ST_X(centroid)), AVG(ST_Y(centroid)), COUNT(*)
                 FROM (SELECT
                         COALESCE(plx.country_code,
                                  get_country_code(ST_Centroid(pl.geometry))) as cc,
@@ -203,27 +277,43 @@ def update_postcodes(dsn: str, project_dir: Optional[Path], tokenizer: AbstractT
                              ON pl.osm_id = plx.osm_id AND pl.osm_type = plx.osm_type
                     WHERE pl.address ? 'postcode' AND pl.geometry IS NOT null) xx
                 WHERE pc IS NOT null AND cc IS NOT null
-                ORDER BY cc, pc""")
+                GROUP BY cc, pc
+                ORDER BY cc""")
 
                 collector = None
 
-                for country, postcode, x, y in cur:
+                for country, postcode, x, y, count in cur:
                     if collector is None or country != collector.country:
                         if collector is not None:
-                            collector.commit(conn, analyzer, project_dir)
+                            _commit_country(executor, collector)
                         collector = _PostcodeCollector(country, matcher.get_matcher(country))
                         todo_countries.discard(country)
-                    collector.add(postcode, x, y)
+                    collector.add(postcode, x, y, count)
 
                 if collector is not None:
-                    collector.commit(conn, analyzer, project_dir)
+                    _commit_country(executor, collector)
+
+            if pending is not None:
+                pending.result()
 
             # Now handle any countries that are only in the postcode table.
+            # Unless there is an external postcode file that needs merging,
+            # all their postcodes are obsolete and can go with one statement.
+            to_drop = []
             for country in todo_countries:
-                fmt = matcher.get_matcher(country)
-                _PostcodeCollector(country, fmt).commit(conn, analyzer, project_dir)
+                if country in external_files:
+                    fmt = matcher.get_matcher(country)
+                    _PostcodeCollector(country, fmt).commit(write_conn, analyzer,
+                                                            external_files[country])
+                else:
+                    to_drop.append(country)
 
-            conn.commit()
+            if to_drop:
+                with write_conn.cursor() as cur:
+                    cur.execute("""DELETE FROM location_postcode
+                                   WHERE country_code = any(%s)""", (to_drop, ))
+
+            write_conn.commit()
 
         analyzer.update_postcodes_from_db()
 
@@ -233,5 +323,7 @@ def can_compute(dsn: str) -> bool:
         Check that the place table exists so that
         postcodes can be computed.
     """
+    from ..db.connection import connect, table_exists
+
     with connect(dsn) as conn:
         return table_exists(conn, 'place')
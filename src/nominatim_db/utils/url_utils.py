@@ -7,7 +7,7 @@
 """
 Helper functions for accessing URL.
 """
-from typing import IO  # noqa
+from typing import IO
 import logging
 import urllib.request as urlrequest
 
@@ -16,6 +16,23 @@ from ..version import NOMINATIM_VERSION
 LOG = logging.getLogger()
 
 
+def open_url(url: str) -> IO[bytes]:
+    """ Open a streaming connection to the given URL and return the
+        response object. The contents can be read incrementally from it
+        and the caller is responsible for closing it.
+
+        This version makes sure that an appropriate user agent is sent.
+    """
+    headers = {"User-Agent": f"Nominatim/{NOMINATIM_VERSION!s}"}
+
+    try:
+        response: IO[bytes] = urlrequest.urlopen(urlrequest.Request(url, headers=headers))
+        return response
+    except Exception:
+        LOG.fatal('Failed to load URL: %s', url)
+        raise
+
+
 def get_url(url: str) -> str:
     """ Get the contents from the given URL and return it as a UTF-8 string.
 
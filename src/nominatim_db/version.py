@@ -55,7 +55,10 @@ def parse_version(version: str) -> NominatimVersion:
     return NominatimVersion(*[int(x) for x in parts[:2] + parts[2].split('-')])
 
 
-NOMINATIM_VERSION = parse_version('5.1.0-0')
+# The version comment is parsed by the packaging scripts to extract the
+# release version (see packaging/nominatim-db/pyproject.toml). Keep it
+# in sync with the tuple.
+NOMINATIM_VERSION = NominatimVersion(5, 1, 0, 0)  # 5.1.0-0
 
 POSTGRESQL_REQUIRED_VERSION = (12, 0)
 POSTGIS_REQUIRED_VERSION = (3, 0)
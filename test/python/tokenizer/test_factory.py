@@ -26,6 +26,8 @@ class TestFactory:
     @pytest.fixture(autouse=True)
     def init_env(self, project_env, property_table, tokenizer_mock):
         self.config = project_env
+        yield
+        factory.invalidate_tokenizer_name_cache()
 
     def test_setup_dummy_tokenizer(self, temp_db_conn):
         tokenizer = factory.create_tokenizer(self.config)
@@ -57,3 +59,25 @@ class TestFactory:
 
         with pytest.raises(UsageError):
             factory.get_tokenizer_for_db(self.config)
+
+    def test_load_tokenizer_from_name_cache(self, temp_db_cursor):
+        factory.create_tokenizer(self.config)
+        factory.get_tokenizer_for_db(self.config)
+
+        temp_db_cursor.execute("TRUNCATE TABLE nominatim_properties")
+
+        # The cached name must be used, no database lookup happens.
+        tokenizer = factory.get_tokenizer_for_db(self.config)
+
+        assert isinstance(tokenizer, DummyTokenizer)
+        assert tokenizer.init_state == "loaded"
+
+    def test_load_tokenizer_invalidated_name_cache(self, temp_db_cursor):
+        factory.create_tokenizer(self.config)
+        factory.get_tokenizer_for_db(self.config)
+
+        temp_db_cursor.execute("TRUNCATE TABLE nominatim_properties")
+        factory.invalidate_tokenizer_name_cache()
+
+        with pytest.raises(UsageError):
+            factory.get_tokenizer_for_db(self.config)
@@ -7,6 +7,7 @@
 """
 Tests for functions to add additional data to the database.
 """
+import io
 from pathlib import Path
 
 import pytest
@@ -18,11 +19,11 @@ class CaptureGetUrl:
 
     def __init__(self, monkeypatch):
         self.url = None
-        monkeypatch.setattr(add_osm_data, 'get_url', self)
+        monkeypatch.setattr(add_osm_data, 'open_url', self)
 
     def __call__(self, url):
         self.url = url
-        return '<xml></xml>'
+        return io.BytesIO(b'<xml></xml>')
 
 
 @pytest.fixture(autouse=True)
@@ -7,6 +7,11 @@
 """
 Tests for tools.exec_utils module.
 """
+import io
+import subprocess
+
+import pytest
+
 import nominatim_db.tools.exec_utils as exec_utils
 
 
@@ -22,3 +27,25 @@ def test_run_osm2pgsql_disable_jit(osm2pgsql_options):
     osm2pgsql_options['import_file'] = 'foo.bar'
     osm2pgsql_options['disable_jit'] = True
     exec_utils.run_osm2pgsql(osm2pgsql_options)
+
+
+def test_run_osm2pgsql_streamed_input_failure(osm2pgsql_options, tmp_path):
+    failing_exec = tmp_path / 'osm2pgsql_failing'
+
+    failing_exec.write_text("""#!/bin/sh
+
+if [ "$*" = "--version" ]; then
+  >&2 echo "2024-08-09 11:16:23  osm2pgsql version 11.7.2 (11.7.2)"
+else
+  exit 3
+fi
+    """)
+    failing_exec.chmod(0o777)
+
+    osm2pgsql_options['osm2pgsql'] = str(failing_exec)
+    osm2pgsql_options['append'] = True
+    # More data than the pipe buffer holds, so the write hits a broken pipe.
+    osm2pgsql_options['import_data'] = io.BytesIO(b'<osm/>' * 1_000_000)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        exec_utils.run_osm2pgsql(osm2pgsql_options)
@@ -113,11 +113,11 @@ def test_postcodes_replace_coordinates(dsn, postcode_table, tmp_path,
 def test_postcodes_replace_coordinates_close(dsn, postcode_table,
                                              insert_implicit_postcode, tokenizer):
     insert_implicit_postcode(1, 'xx', 'POINT(10 12)', dict(postcode='AB 4511'))
-    postcode_table.add('xx', 'AB 4511', 10, 11.99999)
+    postcode_table.add('xx', 'AB 4511', 10, 11.99999999)
 
     postcodes.update_postcodes(dsn, None, tokenizer)
 
-    assert postcode_table.row_set == {('xx', 'AB 4511', 10, 11.99999)}
+    assert postcode_table.row_set == {('xx', 'AB 4511', 10, 11.99999999)}
 
 
 def test_postcodes_remove(dsn, postcode_table,